@@ -1,10 +1,18 @@
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 from agentic_rag import AgenticRAGAgent
+from json_provider import OrJSONProvider
+from semantic_cache import SemanticCache
 import os
+import orjson
+from openai import OpenAI
+from pinecone import Pinecone, ServerlessSpec
+from redis import Redis
+import time
 from datetime import datetime
 
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 CORS(app)
 
 # Initialize the agent
@@ -16,8 +24,54 @@ agent = AgenticRAGAgent(
     pinecone_api_key=PINECONE_API_KEY
 )
 
-# Store conversation history (in production, use Redis or database)
-conversations = {}
+# Semantic cache of recent answers, checked before the agent runs
+openai_client = OpenAI(api_key=OPENAI_API_KEY)
+pc = Pinecone(api_key=PINECONE_API_KEY)
+
+def embed_query(text):
+    response = openai_client.embeddings.create(model="text-embedding-ada-002", input=text)
+    return response.data[0].embedding
+
+# The cache gets its own index sized for ada-002 vectors; the knowledge-base
+# index is built with a different embedding model and dimension
+CACHE_INDEX = os.getenv("PINECONE_CACHE_INDEX", "chat-answer-cache")
+if CACHE_INDEX not in pc.list_indexes().names():
+    pc.create_index(
+        name=CACHE_INDEX,
+        dimension=1536,
+        metric='cosine',
+        spec=ServerlessSpec(cloud='aws', region='us-east-1')
+    )
+
+answer_cache = SemanticCache(index=pc.Index(CACHE_INDEX), embed_query=embed_query)
+
+# Conversation history lives in Redis so it is shared across workers
+redis_client = Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+HISTORY_LENGTH = 10
+HISTORY_TTL = 86400  # seconds a session's history survives without activity
+# Sorted set of session ids scored by last activity, so sessions whose
+# history has expired can be trimmed out
+SESSIONS_KEY = 'stats:active_sessions'
+MESSAGES_KEY = 'stats:messages'
+
+def session_key(session_id):
+    return f"sess:{session_id}"
+
+def load_history(session_id):
+    """Fetch a session's recent exchanges, oldest first"""
+    raw = redis_client.lrange(session_key(session_id), 0, HISTORY_LENGTH - 1)
+    return [orjson.loads(item) for item in reversed(raw)]
+
+def save_exchange(session_id, entry):
+    """Prepend an exchange and cap the session at the last HISTORY_LENGTH"""
+    key = session_key(session_id)
+    pipe = redis_client.pipeline()
+    pipe.lpush(key, orjson.dumps(entry))
+    pipe.ltrim(key, 0, HISTORY_LENGTH - 1)
+    pipe.expire(key, HISTORY_TTL)
+    pipe.zadd(SESSIONS_KEY, {session_id: time.time()})
+    pipe.incr(MESSAGES_KEY)
+    pipe.execute()
 
 @app.route('/')
 def home():
@@ -43,27 +97,28 @@ def chat():
         if not query:
             return jsonify({'error': 'Query is required'}), 400
         
-        # Get or create conversation history
-        if session_id not in conversations:
-            conversations[session_id] = []
+        # Get conversation history
+        conversation_history = load_history(session_id)
         
-        conversation_history = conversations[session_id]
+        # Serve near-identical questions from the cache. Answers to follow-ups
+        # depend on the session's history, so only a fresh session uses it
+        query_vector = None if conversation_history else answer_cache.embed(query)
+        result = answer_cache.lookup(query_vector)
         
-        # Process the query
-        result = agent.process_query(query, conversation_history)
+        if result:
+            result['route'] = 'CACHE'
+        else:
+            # Process the query
+            result = agent.process_query(query, conversation_history)
+            answer_cache.store(query_vector, query, result['answer'], result['sources'])
         
         # Update conversation history (keep last 10 exchanges)
-        conversation_history.append({
+        save_exchange(session_id, {
             'user': query,
             'assistant': result['answer'],
             'timestamp': datetime.utcnow().isoformat()
         })
         
-        if len(conversation_history) > 10:
-            conversation_history = conversation_history[-10:]
-        
-        conversations[session_id] = conversation_history
-        
         return jsonify({
             'answer': result['answer'],
             'sources': result['sources'],
@@ -85,8 +140,10 @@ def clear_history():
         data = request.json
         session_id = data.get('session_id', 'default')
         
-        if session_id in conversations:
-            del conversations[session_id]
+        pipe = redis_client.pipeline()
+        pipe.delete(session_key(session_id))
+        pipe.zrem(SESSIONS_KEY, session_id)
+        pipe.execute()
         
         return jsonify({
             'message': 'Conversation history cleared',
@@ -100,8 +157,14 @@ def clear_history():
 def get_stats():
     """Get chatbot statistics"""
     try:
-        total_sessions = len(conversations)
-        total_messages = sum(len(conv) for conv in conversations.values())
+        # Drop sessions idle past HISTORY_TTL (their history has expired)
+        # before counting
+        pipe = redis_client.pipeline()
+        pipe.zremrangebyscore(SESSIONS_KEY, '-inf', time.time() - HISTORY_TTL)
+        pipe.zcard(SESSIONS_KEY)
+        pipe.get(MESSAGES_KEY)
+        _, total_sessions, total_messages = pipe.execute()
+        total_messages = int(total_messages or 0)
         
         return jsonify({
             'total_sessions': total_sessions,
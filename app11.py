@@ -1,38 +1,118 @@
 import os
-from flask import Flask, request, jsonify
+import asyncio
+import hashlib
+import orjson
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
-import jwt
+from jwt import PyJWT, ExpiredSignatureError, InvalidTokenError
+from cachetools import TTLCache
+import threading
+import queue
+import time
+import atexit
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import cache, wraps
 from pinecone import Pinecone, ServerlessSpec
-from langchain.embeddings import OpenAIEmbeddings
+from redis import Redis
+from rq import Queue
+from langchain.embeddings import OpenAIEmbeddings, CacheBackedEmbeddings
+from langchain.storage import RedisStore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Pinecone as LangchainPinecone
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
 from langchain.chat_models import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
-from PyPDF2 import PdfReader
+from langchain.callbacks.base import BaseCallbackHandler
+from json_provider import OrJSONProvider
+from semantic_cache import SemanticCache
+import pdf_text
 import requests
-from io import BytesIO
+import shutil
+import tempfile
+from itertools import islice
 
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 CORS(app)
 
 # Configuration
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///chatbot.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 20,
+    'max_overflow': 20,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800
+}
+# psycopg 3 prepares statements server-side once they've run a few times
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql+psycopg://'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'prepare_threshold': 5}
 
 db = SQLAlchemy(app)
 
+# Background ingestion queue (worker jobs live in tasks.py)
+redis_client = Redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+ingest_queue = Queue('ingest', connection=redis_client)
+INGEST_JOB_TIMEOUT = 1800
+
+def ingest_job_id(document_id):
+    return f"ingest-{document_id}"
+
 # Initialize Pinecone
 pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
 index_name = "africa-creative-economy"
 
-# Initialize embeddings
-embeddings = OpenAIEmbeddings(openai_api_key=os.environ.get('OPENAI_API_KEY'))
+# Ingestion batching
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = 8
+UPSERT_BATCH_SIZE = 100
+FETCH_BATCH_SIZE = 100
+MAX_CONCURRENT_UPSERTS = 10  # Pinecone starts returning 429s much beyond this
+
+# Initialize embeddings, cached in Redis by chunk-text hash so re-ingested
+# content does not go back to OpenAI
+underlying_embeddings = OpenAIEmbeddings(openai_api_key=os.environ.get('OPENAI_API_KEY'))
+embedding_store = RedisStore(client=redis_client, namespace='emb')
+embeddings = CacheBackedEmbeddings.from_bytes_store(
+    underlying_embeddings,
+    embedding_store,
+    namespace=underlying_embeddings.model
+)
+
+# Chat models shared by every conversational chain. The answer model streams
+# its tokens; follow-up questions are condensed by a non-streaming copy so the
+# rephrased question never reaches a streaming client.
+llm = ChatOpenAI(
+    temperature=0.7,
+    model_name="gpt-4",
+    streaming=True,
+    openai_api_key=os.environ.get('OPENAI_API_KEY')
+)
+condense_llm = ChatOpenAI(
+    temperature=0.7,
+    model_name="gpt-4",
+    openai_api_key=os.environ.get('OPENAI_API_KEY')
+)
+
+# The index may not exist until the first document is ingested, so these
+# are built on first use and then reused for the life of the process
+@cache
+def get_index():
+    """Pinecone index handle with a thread pool for parallel upserts"""
+    return pc.Index(index_name, pool_threads=MAX_CONCURRENT_UPSERTS)
+
+@cache
+def get_vectorstore():
+    return LangchainPinecone(get_index(), embeddings, 'text')
+
+@cache
+def get_answer_cache():
+    """Semantic cache of recent answers, checked before retrieval and the LLM"""
+    return SemanticCache(index=get_index(), embed_query=embeddings.embed_query)
 
 # Database Models
 class User(db.Model):
@@ -45,6 +125,8 @@ class User(db.Model):
     conversations = db.relationship('Conversation', backref='user', lazy=True)
 
 class Conversation(db.Model):
+    __table_args__ = (db.Index('ix_conv_user_ts', 'user_id', 'timestamp'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
@@ -52,15 +134,40 @@ class Conversation(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Document(db.Model):
+    __table_args__ = (db.Index('ix_doc_processed', 'processed'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     url = db.Column(db.Text, nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed = db.Column(db.Boolean, default=False)
 
-# Create tables
+# Create tables, plus any indexes added to tables that already exist
 with app.app_context():
     db.create_all()
+    for table in db.metadata.sorted_tables:
+        for table_index in table.indexes:
+            table_index.create(db.engine, checkfirst=True)
+
+# JWT codec and key are built once rather than per request
+jwt = PyJWT()
+jwt_key = app.config['SECRET_KEY'].encode()
+
+# Authenticated users, cached briefly so repeat requests skip the DB lookup
+user_cache = TTLCache(maxsize=10000, ttl=60)
+user_cache_lock = threading.Lock()
+
+def get_cached_user(user_id):
+    with user_cache_lock:
+        user = user_cache.get(user_id)
+    if user is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            # Detach so commits later in the request don't expire its attributes
+            db.session.expunge(user)
+            with user_cache_lock:
+                user_cache[user_id] = user
+    return user
 
 # JWT Token decorator
 def token_required(f):
@@ -69,47 +176,75 @@ def token_required(f):
         token = request.headers.get('Authorization')
         if not token:
             return jsonify({'message': 'Token is missing'}), 401
+        token = token.removeprefix('Bearer ')
         try:
-            if token.startswith('Bearer '):
-                token = token[7:]
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
-        except:
+            data = jwt.decode(
+                token,
+                jwt_key,
+                algorithms=['HS256'],
+                options={'require': ['exp', 'user_id']}
+            )
+        except ExpiredSignatureError:
+            return jsonify({'message': 'Token has expired'}), 401
+        except InvalidTokenError:
+            return jsonify({'message': 'Token is invalid'}), 401
+        
+        current_user = get_cached_user(data['user_id'])
+        if current_user is None:
             return jsonify({'message': 'Token is invalid'}), 401
         return f(current_user, *args, **kwargs)
     return decorated
 
 # RAG Helper Functions
-def download_pdf(url):
-    """Download PDF from URL"""
-    response = requests.get(url)
-    return BytesIO(response.content)
-
-def extract_text_from_pdf(pdf_file):
-    """Extract text from PDF"""
-    pdf_reader = PdfReader(pdf_file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
+def batched(iterable, n):
+    """Yield successive lists of up to n items"""
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+async def embed_all(texts):
+    """Embed texts in concurrent batches, preserving their order"""
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    
+    async def embed_batch(batch):
+        async with semaphore:
+            return await embeddings.aembed_documents(batch)
+    
+    results = await asyncio.gather(
+        *[embed_batch(batch) for batch in batched(texts, EMBED_BATCH_SIZE)]
+    )
+    return [vec for batch in results for vec in batch]
+
+def extract_text_from_pdf_url(url):
+    """Stream a PDF from URL to a temp file and extract its text"""
+    with requests.get(url, stream=True) as response, \
+            tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        shutil.copyfileobj(response.raw, pdf_file)
+        pdf_file.flush()
+        
+        return pdf_text.extract_text(pdf_file.name)
 
 def process_and_embed_document(url, filename):
     """Process PDF and embed in Pinecone"""
     try:
         # Download and extract text
-        pdf_file = download_pdf(url)
-        text = extract_text_from_pdf(pdf_file)
+        text = extract_text_from_pdf_url(url)
         
-        # Split text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+        # Split text into chunks measured in embedding-model tokens
+        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            model_name=underlying_embeddings.model,
+            chunk_size=500,
+            chunk_overlap=50
         )
         chunks = text_splitter.split_text(text)
         
-        # Create metadata
-        metadatas = [{"source": filename, "chunk": i} for i in range(len(chunks))]
+        # Create metadata (chunk text is stored under LangChain's default text key)
+        metadatas = [
+            {"source": filename, "chunk": i, "text": chunk}
+            for i, chunk in enumerate(chunks)
+        ]
         
         # Check if index exists, create if not
         if index_name not in pc.list_indexes().names():
@@ -120,13 +255,40 @@ def process_and_embed_document(url, filename):
                 spec=ServerlessSpec(cloud='aws', region='us-east-1')
             )
         
-        # Embed and store in Pinecone
-        vectorstore = LangchainPinecone.from_texts(
-            chunks,
-            embeddings,
-            index_name=index_name,
-            metadatas=metadatas
-        )
+        index = get_index()
+        
+        # Key chunks by content hash so boilerplate shared between documents,
+        # or a document ingested twice, is only embedded and stored once
+        pending = {}
+        for chunk, meta in zip(chunks, metadatas):
+            pending.setdefault(hashlib.sha256(chunk.encode()).hexdigest(), (chunk, meta))
+        
+        existing = set()
+        for batch in batched(pending, FETCH_BATCH_SIZE):
+            existing.update(index.fetch(ids=batch).vectors.keys())
+        
+        new_chunks = [
+            (vector_id, chunk, meta)
+            for vector_id, (chunk, meta) in pending.items()
+            if vector_id not in existing
+        ]
+        print(f"Embedding {len(new_chunks)} of {len(chunks)} chunks from {filename}")
+        
+        # Embed in concurrent batches
+        embeds = asyncio.run(embed_all([chunk for _, chunk, _ in new_chunks]))
+        
+        vectors = [
+            (vector_id, vec, meta)
+            for (vector_id, _, meta), vec in zip(new_chunks, embeds)
+        ]
+        
+        # Upsert in parallel; the index's thread pool caps requests in flight
+        async_results = [
+            index.upsert(vectors=batch, async_req=True)
+            for batch in batched(vectors, UPSERT_BATCH_SIZE)
+        ]
+        for result in async_results:
+            result.get()
         
         return True
     except Exception as e:
@@ -135,10 +297,13 @@ def process_and_embed_document(url, filename):
 
 def get_conversational_chain(user_id):
     """Create conversational chain with memory"""
-    # Get user's conversation history
-    history = Conversation.query.filter_by(user_id=user_id).order_by(
-        Conversation.timestamp.desc()
-    ).limit(10).all()
+    # Get user's conversation history (only the columns memory needs)
+    history = db.session.execute(
+        db.select(Conversation.message, Conversation.response)
+        .where(Conversation.user_id == user_id)
+        .order_by(Conversation.timestamp.desc())
+        .limit(10)
+    ).all()
     
     # Initialize memory
     memory = ConversationBufferMemory(
@@ -148,26 +313,18 @@ def get_conversational_chain(user_id):
     )
     
     # Load previous conversations into memory
-    for conv in reversed(history):
-        memory.chat_memory.add_user_message(conv.message)
-        memory.chat_memory.add_ai_message(conv.response)
-    
-    # Create vectorstore
-    vectorstore = LangchainPinecone.from_existing_index(
-        index_name=index_name,
-        embedding=embeddings
-    )
+    for message, response in reversed(history):
+        memory.chat_memory.add_user_message(message)
+        memory.chat_memory.add_ai_message(response)
     
     # Create conversational chain
-    llm = ChatOpenAI(
-        temperature=0.7,
-        model_name="gpt-4",
-        openai_api_key=os.environ.get('OPENAI_API_KEY')
-    )
-    
     chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
-        retriever=vectorstore.as_retriever(search_kwargs={"k": 3}),
+        condense_question_llm=condense_llm,
+        retriever=get_vectorstore().as_retriever(
+            search_type="mmr",
+            search_kwargs={"k": 3, "fetch_k": 10, "lambda_mult": 0.5}
+        ),
         memory=memory,
         return_source_documents=True,
         verbose=True
@@ -175,6 +332,142 @@ def get_conversational_chain(user_id):
     
     return chain
 
+def condense_question(chain, message):
+    """Rewrite a follow-up as a standalone question using the chain's memory"""
+    chat_history = chain.memory.load_memory_variables({})['chat_history']
+    if not chat_history:
+        return message
+    get_chat_history = chain.get_chat_history or _get_chat_history
+    return chain.question_generator.run(
+        question=message,
+        chat_history=get_chat_history(chat_history)
+    )
+
+def answer_question(chain, question, callbacks=None):
+    """Answer an already-condensed question, returning (answer, source documents)"""
+    # The chain's own call would condense the question a second time, so
+    # retrieval and the QA step are run directly
+    docs = chain.retriever.get_relevant_documents(question)
+    answer = chain.combine_docs_chain.run(
+        input_documents=docs,
+        question=question,
+        callbacks=callbacks
+    )
+    return answer, docs
+
+# Conversation writes are queued and bulk-inserted by a background thread,
+# so chat requests don't wait on an INSERT + commit each
+CONVERSATION_FLUSH_ROWS = 50
+CONVERSATION_FLUSH_INTERVAL = 0.1  # seconds
+CONVERSATION_WRITE_ATTEMPTS = 5
+CONVERSATION_RETRY_DELAY = 0.5  # seconds, doubled after each failed attempt
+pending_conversations = queue.Queue()
+
+def write_conversations(rows):
+    with app.app_context():
+        db.session.execute(db.insert(Conversation), rows)
+        db.session.commit()
+
+def flush_conversations():
+    """Write queued conversations every 100ms or 50 rows, whichever comes first"""
+    while True:
+        batch = [pending_conversations.get()]
+        deadline = time.monotonic() + CONVERSATION_FLUSH_INTERVAL
+        while len(batch) < CONVERSATION_FLUSH_ROWS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending_conversations.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        # Retry transient DB errors with backoff; rows queued meanwhile wait
+        # for the next batch, so history is still written in order
+        for attempt in range(CONVERSATION_WRITE_ATTEMPTS):
+            try:
+                write_conversations(batch)
+                break
+            except Exception as e:
+                print(f"Error saving conversations (attempt {attempt + 1}): {str(e)}")
+                time.sleep(CONVERSATION_RETRY_DELAY * 2 ** attempt)
+        else:
+            print(f"Dropped {len(batch)} conversations after {CONVERSATION_WRITE_ATTEMPTS} attempts")
+
+def drain_conversations():
+    """Write whatever is still queued when the process exits"""
+    batch = []
+    while True:
+        try:
+            batch.append(pending_conversations.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        write_conversations(batch)
+
+threading.Thread(target=flush_conversations, daemon=True).start()
+atexit.register(drain_conversations)
+
+def save_conversation(user_id, message, response):
+    pending_conversations.put({
+        'user_id': user_id,
+        'message': message,
+        'response': response,
+        'timestamp': datetime.utcnow()
+    })
+
+# Streaming Helpers
+class TokenQueueHandler(BaseCallbackHandler):
+    """Forward streamed LLM tokens to a queue; None marks the end"""
+    def __init__(self):
+        self.tokens = queue.Queue()
+    
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.put(token)
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {orjson.dumps(payload).decode()}\n\n"
+
+def stream_chat(user_id, chain, message, question, query_vector, cached):
+    """Answer as Server-Sent Events: 'token' events, then one 'done' event"""
+    answer_cache = get_answer_cache()
+    
+    @stream_with_context
+    def generate():
+        if cached:
+            response = cached['answer']
+            sources = cached['sources']
+            yield sse_event('token', {'t': response})
+        else:
+            handler = TokenQueueHandler()
+            outcome = {}
+            
+            def run_chain():
+                try:
+                    outcome['result'] = answer_question(chain, question, callbacks=[handler])
+                except Exception as e:
+                    outcome['error'] = e
+                finally:
+                    handler.tokens.put(None)
+            
+            threading.Thread(target=run_chain, daemon=True).start()
+            while (token := handler.tokens.get()) is not None:
+                yield sse_event('token', {'t': token})
+            
+            if 'error' in outcome:
+                yield sse_event('error', {'message': f"Error: {str(outcome['error'])}"})
+                return
+            
+            response, docs = outcome['result']
+            sources = [doc.metadata for doc in docs]
+            answer_cache.store(query_vector, question, response, sources)
+        
+        # Persist once the full answer is known
+        save_conversation(user_id, message, response)
+        yield sse_event('done', {'response': response, 'sources': sources})
+    
+    return Response(generate(), mimetype='text/event-stream')
+
 # Routes
 @app.route('/api/auth/signup', methods=['POST'])
 def signup():
@@ -276,15 +569,40 @@ def add_document(current_user):
     db.session.add(document)
     db.session.commit()
     
-    # Process in background (in production, use Celery)
-    success = process_and_embed_document(url, filename)
+    # Process in background
+    job = ingest_queue.enqueue(
+        'tasks.ingest_document',
+        document.id,
+        job_id=ingest_job_id(document.id),
+        job_timeout=INGEST_JOB_TIMEOUT
+    )
     
-    if success:
-        document.processed = True
-        db.session.commit()
-        return jsonify({'message': 'Document processed successfully'}), 200
+    return jsonify({
+        'message': 'Document queued for processing',
+        'id': document.id,
+        'job_id': job.id,
+        'status': 'queued'
+    }), 202
+
+@app.route('/api/documents/<int:document_id>/status', methods=['GET'])
+@token_required
+def get_document_status(current_user, document_id):
+    document = db.session.get(Document, document_id)
+    if not document:
+        return jsonify({'message': 'Document not found'}), 404
+    
+    job = ingest_queue.fetch_job(ingest_job_id(document.id))
+    if job:
+        status = job.get_status()
     else:
-        return jsonify({'message': 'Error processing document'}), 500
+        # Job results expire from Redis; fall back to the stored flag
+        status = 'finished' if document.processed else 'unknown'
+    
+    return jsonify({
+        'id': document.id,
+        'status': status,
+        'processed': document.processed
+    })
 
 @app.route('/api/chat', methods=['POST'])
 @token_required
@@ -299,22 +617,32 @@ def chat(current_user):
         # Get conversational chain with user history
         chain = get_conversational_chain(current_user.id)
         
-        # Get response
-        result = chain({"question": message})
-        response = result['answer']
+        # Serve near-identical questions from the cache. Follow-ups are first
+        # condensed against the user's history, so the cache is keyed on a
+        # question that stands on its own and can be shared between users
+        question = condense_question(chain, message)
+        answer_cache = get_answer_cache()
+        query_vector = answer_cache.embed(question)
+        cached = answer_cache.lookup(query_vector)
+        
+        if data.get('stream'):
+            return stream_chat(current_user.id, chain, message, question, query_vector, cached)
+        
+        if cached:
+            response = cached['answer']
+            sources = cached['sources']
+        else:
+            # Get response
+            response, docs = answer_question(chain, question)
+            sources = [doc.metadata for doc in docs]
+            answer_cache.store(query_vector, question, response, sources)
         
         # Save conversation
-        conversation = Conversation(
-            user_id=current_user.id,
-            message=message,
-            response=response
-        )
-        db.session.add(conversation)
-        db.session.commit()
+        save_conversation(current_user.id, message, response)
         
         return jsonify({
             'response': response,
-            'sources': [doc.metadata for doc in result.get('source_documents', [])]
+            'sources': sources
         })
     
     except Exception as e:
@@ -1,24 +1,41 @@
+# Patch sockets, ssl and threading before anything else imports them, so
+# requests/OpenAI/Pinecone I/O yields to other greenlets instead of
+# blocking the worker
+from gevent import monkey
+monkey.patch_all()
+
 import os
+
+# psycopg2 talks to Postgres in C; this makes its waits cooperative too
+if os.environ.get('DATABASE_URL', '').startswith('postgres'):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+import gevent
+from gevent.pool import Pool
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from flask_caching import Cache
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 from datetime import datetime, timedelta
-from functools import wraps
-from pinecone import Pinecone, ServerlessSpec
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Pinecone as LangchainPinecone
-from langchain.chains import ConversationalRetrievalChain
-from langchain.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
-from PyPDF2 import PdfReader
+from functools import cache, wraps
+from collections import OrderedDict
+from gevent.threadpool import ThreadPoolExecutor
+import threading
+from embedding_cache import EmbeddingCache
+import pdf_text
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import shutil
+import tempfile
+import hashlib
 from bs4 import BeautifulSoup
-import time
 
 app = Flask(__name__)
 CORS(app)
@@ -27,15 +44,97 @@ CORS(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///chatbot.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 20,
+    'max_overflow': 40,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800
+}
 
 db = SQLAlchemy(app)
 
-# Initialize Pinecone
-pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
+# Cache for slow-changing, frequently polled knowledge-base queries. It lives
+# in Redis so an invalidation reaches every worker; without REDIS_URL it falls
+# back to a per-process cache, where other workers only see changes once
+# their entries time out.
+if os.environ.get('REDIS_URL'):
+    query_cache = Cache(app, config={
+        'CACHE_TYPE': 'RedisCache',
+        'CACHE_REDIS_URL': os.environ['REDIS_URL'],
+        'CACHE_KEY_PREFIX': 'communique:'
+    })
+else:
+    query_cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+
+# Pinecone, LangChain and the models behind them are imported and built on
+# first use by the getters below, so workers start quickly and endpoints
+# like /health and /api/auth/* never load them
 index_name = "africa-creative-economy"
 
-# Initialize embeddings
-embeddings = OpenAIEmbeddings(openai_api_key=os.environ.get('OPENAI_API_KEY'))
+@cache
+def get_pinecone():
+    """Pinecone client, created on first use"""
+    from pinecone import Pinecone
+    return Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
+
+# Popular questions repeat, so query embeddings are cached
+query_embedding_cache = EmbeddingCache()
+
+@cache
+def get_embeddings():
+    """OpenAI embeddings that reuse recent query embeddings"""
+    from langchain.embeddings import OpenAIEmbeddings
+    
+    class CachedQueryEmbeddings(OpenAIEmbeddings):
+        def embed_query(self, text):
+            return query_embedding_cache.get_or_compute(text, super().embed_query)
+    
+    return CachedQueryEmbeddings(openai_api_key=os.environ.get('OPENAI_API_KEY'))
+
+# One pooled session so repeat requests to the same host reuse connections;
+# sized for the many greenlets a gevent worker runs at once
+http_session = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=50,
+    pool_maxsize=100,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+)
+http_session.mount('http://', http_adapter)
+http_session.mount('https://', http_adapter)
+
+# Ingestion limits
+INGEST_CONCURRENCY = 8
+UPSERT_BATCH_SIZE = 100
+MAX_CONCURRENT_UPSERTS = 10
+
+# Custom prompt for Africa Creative Economy context. The static instructions
+# come first so every request shares the same prefix and the provider can
+# serve it from its prompt cache; retrieved context and the question follow.
+SYSTEM_PROMPT = """You are an expert assistant specializing in Africa's creative economy, 
+drawing insights from Communiqué's African Creative Economy Database and related resources.
+
+Provide detailed, accurate information about Africa's creative industries including:
+- Film & TV (Nollywood, Riverwood, production houses, streaming platforms)
+- Music (labels, festivals, streaming platforms)
+- Fashion (designers, brands, African styles)
+- Gaming (developers, esports, platforms)
+- Creator Economy (digital platforms, tools)
+- Media (publishers, digital outlets)
+- Creative Arts (galleries, theater, art collectives)
+- Cultural Heritage (museums, heritage institutions)
+
+Include relevant statistics, organizations, investors, events, and policy insights when available.
+If you mention specific entities or data, cite the source from the context."""
+
+@cache
+def get_qa_prompt():
+    """Question-answering prompt for the combine-docs step"""
+    from langchain.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        ("system", "Context from the database:\n{context}"),
+        ("human", "{question}")
+    ])
 
 # Database Models
 class User(db.Model):
@@ -62,9 +161,73 @@ class Document(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed = db.Column(db.Boolean, default=False)
 
-# Create tables
+# Indexes for the history lookups and the per-URL dedupe check
+db.Index('ix_conv_user_ts', Conversation.user_id, Conversation.timestamp.desc())
+db.Index('ix_document_url', Document.url, unique=True)
+
+@query_cache.memoize(timeout=30)
+def list_documents():
+    return [{
+        'id': doc.id,
+        'filename': doc.filename,
+        'url': doc.url,
+        'source_type': doc.source_type,
+        'processed': doc.processed,
+        'uploaded_at': doc.uploaded_at.isoformat()
+    } for doc in Document.query.all()]
+
+@query_cache.memoize(timeout=60)
+def count_documents():
+    """Return (total, processed) document counts"""
+    return Document.query.count(), Document.query.filter_by(processed=True).count()
+
+def invalidate_document_caches():
+    query_cache.delete_memoized(list_documents)
+    query_cache.delete_memoized(count_documents)
+
+def dedupe_document_urls():
+    """Drop duplicate Document rows left by the old check-then-insert, keeping the oldest per URL"""
+    keep_ids = db.session.query(db.func.min(Document.id)).group_by(Document.url)
+    processed_urls = db.session.query(Document.url).filter(Document.processed.is_(True))
+    
+    # A URL counts as processed if any of its copies was
+    Document.query.filter(
+        Document.id.in_(keep_ids), Document.url.in_(processed_urls)
+    ).update({'processed': True}, synchronize_session=False)
+    removed = Document.query.filter(Document.id.not_in(keep_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    if removed:
+        print(f"Removed {removed} duplicate document rows")
+
+# Create tables, plus any indexes added to tables that already exist
 with app.app_context():
     db.create_all()
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+        for table_index in table.indexes:
+            if table_index.name in existing:
+                continue
+            try:
+                if table_index.name == 'ix_document_url':
+                    dedupe_document_urls()
+                table_index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                # e.g. another worker created it first; serve without it
+                # rather than failing to start
+                db.session.rollback()
+                print(f"Error creating index {table_index.name}: {str(e)}")
+
+# Password hashing is deliberately CPU-heavy. It runs on a dedicated pool of
+# real OS threads (gevent's threadpool, since threading is monkey-patched),
+# sized to the CPU count, so a burst of signups/logins can't stall every
+# greenlet; the hash functions release the GIL while they work.
+crypto_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+def hash_password(password):
+    return crypto_pool.submit(generate_password_hash, password).result()
+
+def verify_password(password_hash, password):
+    return crypto_pool.submit(check_password_hash, password_hash, password).result()
 
 # JWT Token decorator
 def token_required(f):
@@ -90,109 +253,164 @@ def scrape_communique_article(url):
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_session.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title = soup.find('h1')
-        title_text = title.get_text(strip=True) if title else ""
-        
-        # Extract article content (adjust selectors based on actual site structure)
-        article_body = soup.find('article') or soup.find('div', class_='post-content')
-        
-        if article_body:
-            # Remove script and style elements
-            for script in article_body(["script", "style"]):
-                script.decompose()
-            
-            text = article_body.get_text(separator='\n', strip=True)
-            return f"{title_text}\n\n{text}"
-        
-        return ""
+        # Parsing is CPU-bound, so it runs on a real OS thread rather than
+        # blocking every greenlet in the worker
+        return gevent.get_hub().threadpool.apply(parse_communique_article, (response.content,))
     except Exception as e:
         print(f"Error scraping article: {str(e)}")
         return None
 
+def parse_communique_article(html):
+    """Extract the title and body text from a Communiqué article page"""
+    soup = BeautifulSoup(html, 'lxml')
+    
+    # Extract title
+    title = soup.find('h1')
+    title_text = title.get_text(strip=True) if title else ""
+    
+    # Extract article content (adjust selectors based on actual site structure)
+    article_body = soup.find('article') or soup.find('div', class_='post-content')
+    
+    if article_body:
+        # Remove script and style elements
+        for script in article_body(["script", "style"]):
+            script.decompose()
+        
+        text = article_body.get_text(separator='\n', strip=True)
+        return f"{title_text}\n\n{text}"
+    
+    return ""
+
 def download_pdf(url):
-    """Download PDF from URL"""
+    """Download PDF from URL to a temporary file, deleted when closed"""
+    pdf_file = tempfile.NamedTemporaryFile(suffix='.pdf')
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        return BytesIO(response.content)
+        with http_session.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            # Stream the body straight to disk rather than holding it in memory
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, pdf_file)
+        pdf_file.flush()
+        return pdf_file
     except Exception as e:
+        pdf_file.close()
         print(f"Error downloading PDF: {str(e)}")
         return None
 
 def extract_text_from_pdf(pdf_file):
     """Extract text from PDF"""
     try:
-        pdf_reader = PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        return text
+        # Pages are extracted in the shared worker-process pool (PDFium isn't
+        # thread-safe), large PDFs split into page ranges; small ones are
+        # offloaded too so extraction never blocks this worker's greenlets
+        return pdf_text.extract_text(pdf_file.name, offload=True)
     except Exception as e:
         print(f"Error extracting PDF text: {str(e)}")
         return None
 
-def process_and_embed_document(url, filename, source_type='pdf'):
+def extract_document_text(url, source_type):
+    """Fetch a document/article and extract its text"""
+    if source_type == 'article':
+        return scrape_communique_article(url)
+    if source_type == 'pdf':
+        pdf_file = download_pdf(url)
+        if not pdf_file:
+            return None
+        with pdf_file:
+            return extract_text_from_pdf(pdf_file)
+    return None
+
+def ensure_index():
+    """Create the Pinecone index if it doesn't exist yet"""
+    from pinecone import ServerlessSpec
+    pc = get_pinecone()
+    if index_name not in pc.list_indexes().names():
+        pc.create_index(
+            name=index_name,
+            dimension=1536,
+            metric='cosine',
+            spec=ServerlessSpec(cloud='aws', region='us-east-1')
+        )
+
+@cache
+def get_index():
+    """Pinecone index handle with a thread pool for parallel upserts, reused for the life of the process"""
+    # The client defaults to a single pool thread, which would send every
+    # async_req upsert one at a time
+    return get_pinecone().Index(index_name, pool_threads=MAX_CONCURRENT_UPSERTS)
+
+def upsert_vectors(vectors):
+    """Upsert vectors in batches, sending the batches in parallel"""
+    index = get_index()
+    async_results = [
+        index.upsert(vectors=vectors[i:i + UPSERT_BATCH_SIZE], async_req=True)
+        for i in range(0, len(vectors), UPSERT_BATCH_SIZE)
+    ]
+    for result in async_results:
+        result.get()
+
+@cache
+def get_text_splitter():
+    """Character splitter shared by every ingest"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+
+def chunk_document(url, filename, source_type='pdf'):
+    """Fetch a document/article and split it into (ids, chunks, metadatas), or None"""
+    text = extract_document_text(url, source_type)
+    
+    if not text or len(text.strip()) < 100:
+        print(f"Insufficient content extracted from {url}")
+        return None
+    
+    # Split text into chunks
+    chunks = get_text_splitter().split_text(text)
+    
+    # Create metadata (chunk text is stored under LangChain's default text key)
+    metadatas = [
+        {
+            "source": filename,
+            "url": url,
+            "chunk": i,
+            "type": source_type,
+            "text": chunk
+        } for i, chunk in enumerate(chunks)
+    ]
+    
+    # Ids are derived from the URL, so re-ingesting a document overwrites its
+    # vectors instead of duplicating them
+    url_hash = hashlib.sha256(url.encode()).hexdigest()
+    ids = [f"{url_hash}_{i}" for i in range(len(chunks))]
+    return ids, chunks, metadatas
+
+def process_document(url, filename, source_type='pdf'):
     """Process document/article and embed in Pinecone"""
     try:
-        # Extract text based on source type
-        if source_type == 'article':
-            text = scrape_communique_article(url)
-        elif source_type == 'pdf':
-            pdf_file = download_pdf(url)
-            if pdf_file:
-                text = extract_text_from_pdf(pdf_file)
-            else:
-                return False
-        else:
+        chunked = chunk_document(url, filename, source_type)
+        if chunked is None:
             return False
+        ids, chunks, metadatas = chunked
         
-        if not text or len(text.strip()) < 100:
-            print(f"Insufficient content extracted from {url}")
-            return False
+        # Embed all chunks in one batched request
+        vectors = get_embeddings().embed_documents(chunks)
         
-        # Split text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        chunks = text_splitter.split_text(text)
-        
-        # Create metadata
-        metadatas = [
-            {
-                "source": filename,
-                "url": url,
-                "chunk": i,
-                "type": source_type
-            } for i in range(len(chunks))
+        # Store in Pinecone
+        upserts = [
+            {'id': chunk_id, 'values': vector, 'metadata': metadata}
+            for chunk_id, vector, metadata in zip(ids, vectors, metadatas)
         ]
+        upsert_vectors(upserts)
         
-        # Check if index exists, create if not
-        if index_name not in pc.list_indexes().names():
-            pc.create_index(
-                name=index_name,
-                dimension=1536,
-                metric='cosine',
-                spec=ServerlessSpec(cloud='aws', region='us-east-1')
-            )
-        
-        # Embed and store in Pinecone
-        vectorstore = LangchainPinecone.from_texts(
-            chunks,
-            embeddings,
-            index_name=index_name,
-            metadatas=metadatas
-        )
+        # Index the same chunks for keyword search
+        get_bm25_corpus().add(ids, chunks, metadatas)
         
         print(f"Successfully embedded {len(chunks)} chunks from {filename}")
         return True
@@ -200,76 +418,168 @@ def process_and_embed_document(url, filename, source_type='pdf'):
         print(f"Error processing document: {str(e)}")
         return False
 
-def get_conversational_chain(user_id):
-    """Create conversational chain with memory and custom prompt"""
-    # Get user's conversation history
-    history = Conversation.query.filter_by(user_id=user_id).order_by(
-        Conversation.timestamp.desc()
-    ).limit(10).all()
+def process_documents(documents):
+    """Process (url, filename, source_type) tuples concurrently, returning a success flag for each"""
+    ensure_index()
     
-    # Initialize memory
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
-        output_key='answer'
+    # Each document gets its own greenlet; their network I/O (fetch, OpenAI,
+    # Pinecone) is cooperative under gevent, so documents overlap
+    pool = Pool(INGEST_CONCURRENCY)
+    return list(pool.imap(lambda document: process_document(*document), documents))
+
+def process_and_embed_document(url, filename, source_type='pdf'):
+    """Process a single document/article and embed in Pinecone"""
+    try:
+        return process_documents([(url, filename, source_type)])[0]
+    except Exception as e:
+        print(f"Error processing document: {str(e)}")
+        return False
+
+@cache
+def get_llm():
+    """Chat model shared by every conversational chain"""
+    from langchain.chat_models import ChatOpenAI
+    return ChatOpenAI(
+        temperature=0.7,
+        model_name="gpt-4",
+        openai_api_key=os.environ.get('OPENAI_API_KEY')
     )
-    
-    # Load previous conversations into memory
-    for conv in reversed(history):
-        memory.chat_memory.add_user_message(conv.message)
-        memory.chat_memory.add_ai_message(conv.response)
-    
-    # Create vectorstore
-    vectorstore = LangchainPinecone.from_existing_index(
-        index_name=index_name,
-        embedding=embeddings
+
+@cache
+def get_vectorstore():
+    """Vectorstore over the shared index handle, built on first use"""
+    from langchain.vectorstores import Pinecone as LangchainPinecone
+    return LangchainPinecone(get_index(), get_embeddings(), 'text')
+
+@cache
+def get_bm25_corpus():
+    """Keyword index over the same chunks as Pinecone, appended to at ingest time"""
+    from hybrid_retriever import BM25Corpus
+    # Rebuilding the index is CPU-bound, so it runs on a native thread
+    return BM25Corpus(
+        os.environ.get('BM25_CORPUS_PATH', 'bm25_corpus.jsonl'),
+        spawn=gevent.get_hub().threadpool.spawn
     )
-    
-    # Custom prompt for Africa Creative Economy context
-    custom_prompt = PromptTemplate(
-        input_variables=["context", "question"],
-        template="""You are an expert assistant specializing in Africa's creative economy, 
-drawing insights from Communiqué's African Creative Economy Database and related resources.
 
-Context from the database:
-{context}
+def index_document_keywords(url, filename, source_type):
+    """Add an already-embedded document's chunks to the keyword index only"""
+    try:
+        chunked = chunk_document(url, filename, source_type)
+        if chunked is None:
+            return False
+        get_bm25_corpus().add(*chunked)
+        return True
+    except Exception as e:
+        print(f"Error indexing keywords for {url}: {str(e)}")
+        return False
 
-Question: {question}
+@app.cli.command('backfill-bm25')
+def backfill_bm25():
+    """Add processed documents that predate the keyword index to it"""
+    indexed = get_bm25_corpus().urls()
+    missing = [
+        document for document in Document.query.with_entities(
+            Document.url, Document.filename, Document.source_type
+        ).filter_by(processed=True).all()
+        if document.url not in indexed
+    ]
+    
+    pool = Pool(INGEST_CONCURRENCY)
+    added = sum(pool.imap(lambda document: index_document_keywords(*document), missing))
+    print(f"Indexed {added}/{len(missing)} documents for keyword search")
 
-Provide detailed, accurate information about Africa's creative industries including:
-- Film & TV (Nollywood, Riverwood, production houses, streaming platforms)
-- Music (labels, festivals, streaming platforms)
-- Fashion (designers, brands, African styles)
-- Gaming (developers, esports, platforms)
-- Creator Economy (digital platforms, tools)
-- Media (publishers, digital outlets)
-- Creative Arts (galleries, theater, art collectives)
-- Cultural Heritage (museums, heritage institutions)
+@cache
+def get_retriever():
+    """Hybrid dense + BM25 retriever; fusing the two keeps recall at k=3"""
+    from hybrid_retriever import HybridRetriever
+    return HybridRetriever(vectorstore=get_vectorstore(), corpus=get_bm25_corpus(), k=3)
 
-Include relevant statistics, organizations, investors, events, and policy insights when available.
-If you mention specific entities or data, cite the source from the context.
+# Chains are cached per user so their memory stays warm between turns; the
+# chain saves each exchange to its own memory. Each worker process keeps its
+# own cache of recent users, so every entry records the newest Conversation
+# id its memory includes, and is rebuilt when another worker has saved a
+# newer turn for that user.
+CHAIN_CACHE_SIZE = 1024
+HISTORY_TURNS = 10
+user_chains = OrderedDict()  # user_id -> (chain, newest conversation id, lock)
+user_chains_lock = threading.Lock()
 
-Answer:"""
-    )
+def latest_conversation_id(user_id):
+    """Newest Conversation id for the user (a lookup on the user_id index)"""
+    return db.session.query(db.func.max(Conversation.id)).filter(
+        Conversation.user_id == user_id
+    ).scalar()
+
+def build_conversational_chain(user_id):
+    """Create conversational chain with memory and custom prompt"""
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain.memory import ConversationBufferMemory, ChatMessageHistory
+    from langchain.schema import HumanMessage, AIMessage
     
-    # Create conversational chain
-    llm = ChatOpenAI(
-        temperature=0.7,
-        model_name="gpt-4",
-        openai_api_key=os.environ.get('OPENAI_API_KEY')
+    # Get user's conversation history (only the columns memory needs)
+    history = Conversation.query.with_entities(
+        Conversation.message, Conversation.response
+    ).filter(Conversation.user_id == user_id).order_by(
+        Conversation.timestamp.desc()
+    ).limit(HISTORY_TURNS).all()
+    
+    # Initialize memory with previous conversations, oldest first
+    messages = [
+        chat_message
+        for message, response in reversed(history)
+        for chat_message in (HumanMessage(content=message), AIMessage(content=response))
+    ]
+    memory = ConversationBufferMemory(
+        chat_memory=ChatMessageHistory(messages=messages),
+        memory_key="chat_history",
+        return_messages=True,
+        output_key='answer'
     )
     
+    # Create conversational chain
     chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=vectorstore.as_retriever(search_kwargs={"k": 5}),
+        llm=get_llm(),
+        retriever=get_retriever(),
         memory=memory,
         return_source_documents=True,
         verbose=True,
-        combine_docs_chain_kwargs={"prompt": custom_prompt}
+        combine_docs_chain_kwargs={"prompt": get_qa_prompt()}
     )
     
     return chain
 
+def get_conversational_chain(user_id):
+    """Return the user's cached chain and its lock, rebuilding it if missing or out of date"""
+    latest_id = latest_conversation_id(user_id)
+    
+    with user_chains_lock:
+        entry = user_chains.get(user_id)
+        if entry is not None and entry[1] == latest_id:
+            user_chains.move_to_end(user_id)
+            return entry[0], entry[2]
+    
+    chain = build_conversational_chain(user_id)
+    chain_lock = threading.Lock()
+    
+    with user_chains_lock:
+        user_chains[user_id] = (chain, latest_id, chain_lock)
+        user_chains.move_to_end(user_id)
+        while len(user_chains) > CHAIN_CACHE_SIZE:
+            user_chains.popitem(last=False)
+    
+    return chain, chain_lock
+
+def record_turn(user_id, chain, conversation_id):
+    """Mark the cached chain as including the turn it just saved"""
+    with user_chains_lock:
+        entry = user_chains.get(user_id)
+        if entry is not None and entry[0] is chain:
+            user_chains[user_id] = (chain, conversation_id, entry[2])
+
+def trim_memory(chain):
+    """Keep a cached chain's memory to the last HISTORY_TURNS exchanges"""
+    del chain.memory.chat_memory.messages[:-2 * HISTORY_TURNS]
+
 # Routes
 @app.route('/api/auth/signup', methods=['POST'])
 def signup():
@@ -278,7 +588,7 @@ def signup():
     if User.query.filter_by(email=data['email']).first():
         return jsonify({'message': 'User already exists'}), 400
     
-    hashed_password = generate_password_hash(data['password'])
+    hashed_password = hash_password(data['password'])
     new_user = User(
         email=data['email'],
         password_hash=hashed_password,
@@ -307,7 +617,7 @@ def login():
     data = request.json
     user = User.query.filter_by(email=data['email']).first()
     
-    if not user or not check_password_hash(user.password_hash, data['password']):
+    if not user or not verify_password(user.password_hash, data['password']):
         return jsonify({'message': 'Invalid credentials'}), 401
     
     token = jwt.encode({
@@ -383,6 +693,9 @@ def add_document(current_user):
     if success:
         document.processed = True
         db.session.commit()
+    invalidate_document_caches()
+    
+    if success:
         return jsonify({
             'message': 'Document processed successfully',
             'id': document.id
@@ -397,36 +710,56 @@ def bulk_add_documents(current_user):
     data = request.json
     documents = data.get('documents', [])
     
-    results = []
-    for doc in documents:
-        url = doc.get('url')
-        filename = doc.get('filename')
-        source_type = doc.get('source_type', 'article')
-        
-        if not url or not filename:
-            continue
-        
-        # Check if exists
-        existing = Document.query.filter_by(url=url).first()
-        if existing:
-            results.append({'url': url, 'status': 'exists'})
-            continue
-        
-        # Save and process
-        document = Document(filename=filename, url=url, source_type=source_type)
-        db.session.add(document)
+    rows = [
+        {
+            'filename': doc.get('filename'),
+            'url': doc.get('url'),
+            'source_type': doc.get('source_type', 'article')
+        }
+        for doc in documents
+        if doc.get('url') and doc.get('filename')
+    ]
+    if not rows:
+        return jsonify({'results': []}), 200
+    
+    # One statement both dedupes against the unique URL index and inserts;
+    # only rows that were actually inserted come back
+    insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    stmt = insert(Document).values(rows).on_conflict_do_nothing(
+        index_elements=['url']
+    ).returning(Document.id, Document.url)
+    inserted = {url: document_id for document_id, url in db.session.execute(stmt).all()}
+    db.session.commit()
+    
+    new_rows = [row for row in rows if inserted.pop(row['url'], None) is not None]
+    new_urls = {row['url'] for row in new_rows}
+    
+    # Process the new documents concurrently
+    successes = process_documents([
+        (row['url'], row['filename'], row['source_type'])
+        for row in new_rows
+    ]) if new_rows else []
+    
+    statuses = {
+        row['url']: 'success' if success else 'failed'
+        for row, success in zip(new_rows, successes)
+    }
+    processed_urls = [url for url, status in statuses.items() if status == 'success']
+    if processed_urls:
+        Document.query.filter(Document.url.in_(processed_urls)).update(
+            {'processed': True}, synchronize_session=False
+        )
         db.session.commit()
-        
-        success = process_and_embed_document(url, filename, source_type)
-        
-        if success:
-            document.processed = True
-            db.session.commit()
-            results.append({'url': url, 'status': 'success'})
+    invalidate_document_caches()
+    
+    results = []
+    for row in rows:
+        url = row['url']
+        if url in new_urls:
+            results.append({'url': url, 'status': statuses[url]})
+            new_urls.discard(url)
         else:
-            results.append({'url': url, 'status': 'failed'})
-        
-        time.sleep(1)  # Rate limiting
+            results.append({'url': url, 'status': 'exists'})
     
     return jsonify({'results': results}), 200
 
@@ -441,20 +774,25 @@ def chat(current_user):
     
     try:
         # Get conversational chain with user history
-        chain = get_conversational_chain(current_user.id)
-        
-        # Get response
-        result = chain({"question": message})
-        response = result['answer']
+        chain, chain_lock = get_conversational_chain(current_user.id)
         
-        # Save conversation
-        conversation = Conversation(
-            user_id=current_user.id,
-            message=message,
-            response=response
-        )
-        db.session.add(conversation)
-        db.session.commit()
+        # Concurrent requests from the same user (two tabs, a double submit)
+        # share this chain's memory, so they take turns with it
+        with chain_lock:
+            # Get response
+            result = chain({"question": message})
+            response = result['answer']
+            trim_memory(chain)
+            
+            # Save conversation
+            conversation = Conversation(
+                user_id=current_user.id,
+                message=message,
+                response=response
+            )
+            db.session.add(conversation)
+            db.session.commit()
+            record_turn(current_user.id, chain, conversation.id)
         
         # Format sources
         sources = []
@@ -491,22 +829,13 @@ def get_history(current_user):
 @app.route('/api/documents', methods=['GET'])
 @token_required
 def get_documents(current_user):
-    documents = Document.query.all()
-    return jsonify([{
-        'id': doc.id,
-        'filename': doc.filename,
-        'url': doc.url,
-        'source_type': doc.source_type,
-        'processed': doc.processed,
-        'uploaded_at': doc.uploaded_at.isoformat()
-    } for doc in documents])
+    return jsonify(list_documents())
 
 @app.route('/api/stats', methods=['GET'])
 @token_required
 def get_stats(current_user):
     """Get statistics about the knowledge base"""
-    total_docs = Document.query.count()
-    processed_docs = Document.query.filter_by(processed=True).count()
+    total_docs, processed_docs = count_documents()
     user_conversations = Conversation.query.filter_by(user_id=current_user.id).count()
     
     return jsonify({
@@ -520,5 +849,6 @@ def health():
     return jsonify({'status': 'healthy'})
 
 if __name__ == '__main__':
+    from gevent.pywsgi import WSGIServer
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    WSGIServer(('0.0.0.0', port), app).serve_forever()
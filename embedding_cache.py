@@ -0,0 +1,24 @@
+import hashlib
+import threading
+from typing import Callable, List
+
+from cachetools import TTLCache
+
+class EmbeddingCache:
+    def __init__(self, maxsize: int = 10_000, ttl: int = 3600):
+        """Thread-safe LRU cache of embeddings, keyed by text hash, with expiry"""
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """Return the cached embedding for text, computing it on a miss"""
+        key = hashlib.sha256(text.encode()).hexdigest()
+        with self._lock:
+            embedding = self._cache.get(key)
+
+        if embedding is None:
+            embedding = compute(text)
+            with self._lock:
+                self._cache[key] = embedding
+
+        return embedding
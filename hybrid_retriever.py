@@ -0,0 +1,173 @@
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import orjson
+from rank_bm25 import BM25Okapi
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+from langchain.vectorstores.base import VectorStore
+
+TOKEN_RE = re.compile(r'\w+')
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, used for both the corpus and queries"""
+    return TOKEN_RE.findall(text.lower())
+
+class BM25Corpus:
+    def __init__(self, path: str, refresh_interval: float = 30.0,
+                 spawn: Optional[Callable[[Callable[[], None]], object]] = None):
+        """Keyword index over ingested chunks, persisted as JSON lines at path"""
+        self.path = path
+        self.refresh_interval = refresh_interval
+        # Runs a rebuild in the background; callers can supply a native thread pool
+        self.spawn = spawn or (lambda fn: threading.Thread(target=fn, daemon=True).start())
+        self.lock = threading.Lock()
+        self._records: Dict[str, Dict] = {}
+        self._offset = 0
+        self._version = None
+        # (docs, bm25, postings), where postings maps each term to the indexes
+        # of the docs containing it
+        self._snapshot: Optional[Tuple[List[Document], BM25Okapi, Dict[str, np.ndarray]]] = None
+        self._last_refresh = 0.0
+        self._refreshing = False
+
+    def add(self, ids: List[str], texts: List[str], metadatas: List[Dict]) -> None:
+        """Append tokenized chunks to the on-disk corpus"""
+        # The chunk text is the Document's page_content, so it isn't kept twice
+        lines = b''.join(
+            orjson.dumps({
+                'id': chunk_id,
+                'text': text,
+                'tokens': tokenize(text),
+                'metadata': {key: value for key, value in metadata.items() if key != 'text'}
+            }) + b'\n'
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        )
+        with self.lock:
+            with open(self.path, 'ab') as f:
+                f.write(lines)
+
+    def _rebuild(self) -> None:
+        """Read records appended since the last load and swap in a new BM25 index"""
+        try:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version == self._version:
+                return
+            if stat.st_size < self._offset:
+                # The file was replaced; start over
+                self._records, self._offset = {}, 0
+
+            # Only the new tail is parsed. Re-ingested chunks replace earlier
+            # records with the same id; a trailing line without a newline is
+            # still being written and is picked up next time
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self._offset += len(line)
+                    record = orjson.loads(line)
+                    self._records[record['id']] = record
+
+            records = list(self._records.values())
+            if records:
+                docs = [
+                    Document(page_content=record['text'], metadata=record['metadata'])
+                    for record in records
+                ]
+                postings = defaultdict(list)
+                for i, record in enumerate(records):
+                    for token in set(record['tokens']):
+                        postings[token].append(i)
+                self._snapshot = (
+                    docs,
+                    BM25Okapi([record['tokens'] for record in records]),
+                    {token: np.array(ids) for token, ids in postings.items()}
+                )
+            self._version = version
+        finally:
+            self._refreshing = False
+
+    def refresh(self) -> None:
+        """Pick up chunks appended by any process, rebuilding at most every refresh_interval"""
+        if self._snapshot is None:
+            # Nothing to search yet, so the first load happens inline
+            with self.lock:
+                if self._snapshot is None:
+                    self._refreshing = True
+                    self._rebuild()
+            return
+
+        now = time.monotonic()
+        if self._refreshing or now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+        self._refreshing = True
+        self.spawn(self._rebuild)
+
+    def urls(self) -> Set[str]:
+        """URLs of the documents whose chunks are in the corpus"""
+        with self.lock:
+            self._refreshing = True
+            self._rebuild()
+        return {record['metadata'].get('url') for record in self._records.values()}
+
+    def search(self, query: str, k: int) -> List[Document]:
+        """Return up to k chunks ranked by BM25 score"""
+        self.refresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+
+        docs, bm25, postings = snapshot
+        tokens = tokenize(query)
+
+        # Candidates are the chunks containing a query term. Their score can
+        # legitimately be 0 (a term in exactly half the chunks has an IDF of
+        # 0), so matching is decided by the postings, not by score
+        hits = [postings[token] for token in set(tokens) if token in postings]
+        if not hits:
+            return []
+        candidates = np.unique(np.concatenate(hits))
+        scores = np.asarray(bm25.get_batch_scores(tokens, candidates.tolist()))
+
+        # Partial selection of the top k, then order just those
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [docs[candidates[i]] for i in top]
+
+class HybridRetriever(BaseRetriever):
+    """Fuse dense Pinecone results and BM25 keyword results with Reciprocal Rank Fusion"""
+    vectorstore: VectorStore
+    corpus: BM25Corpus
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        dense = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        sparse = self.corpus.search(query, self.fetch_k)
+
+        # score = sum over result lists of 1 / (rrf_k + rank); the same chunk
+        # from both lists is matched on its text
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+        for results in (dense, sparse):
+            for rank, doc in enumerate(results, 1):
+                key = doc.page_content
+                scores[key] = scores.get(key, 0.0) + 1 / (self.rrf_k + rank)
+                docs.setdefault(key, doc)
+
+        top = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [docs[key] for key in top]
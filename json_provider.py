@@ -0,0 +1,23 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+class OrJSONProvider(JSONProvider):
+    """JSON provider backed by orjson"""
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+    # Types orjson doesn't handle natively (Decimal, __html__ objects, ...)
+    # get the same conversions as Flask's default provider
+    default = staticmethod(DefaultJSONProvider.default)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Emit orjson's bytes directly instead of round-tripping through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype='application/json'
+        )
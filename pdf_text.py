@@ -0,0 +1,101 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+import pypdfium2 as pdfium
+
+# Below this many pages, starting worker processes costs more than it saves
+PARALLEL_MIN_PAGES = 8
+
+def available_cpus() -> int:
+    """CPUs this process may actually use: its affinity mask, capped by a cgroup v2 quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+# One pool per process, created on first use and shared by every extraction,
+# so concurrent documents queue for the same workers instead of each forking
+# their own
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=available_cpus())
+        return _executor
+
+def discard_executor(executor: ProcessPoolExecutor) -> None:
+    """Forget a broken pool so the next call starts a fresh one"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_executor() -> None:
+    """Stop the shared pool's workers, e.g. before a process that used it exits"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+def extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) of the PDF at path"""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        parts = []
+        for i in range(start, stop):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return parts
+    finally:
+        pdf.close()
+
+def extract_text(path: str, offload: bool = False) -> str:
+    """Extract a PDF's text, spreading its pages across worker processes"""
+    pdf = pdfium.PdfDocument(path)
+    page_count = len(pdf)
+    pdf.close()
+
+    workers = min(available_cpus(), page_count)
+    if page_count < PARALLEL_MIN_PAGES or workers < 2:
+        # offload sends small PDFs to a worker too, for callers (like gevent
+        # workers) that must never extract inline
+        if not offload:
+            return "\n".join(extract_page_range(path, 0, page_count))
+        starts, stops = [0], [page_count]
+    else:
+        # One contiguous page range per worker; each process opens its own
+        # PdfDocument, so nothing is shared between them
+        step = -(-page_count // workers)
+        starts = list(range(0, page_count, step))
+        stops = [min(start + step, page_count) for start in starts]
+
+    # A worker can die mid-extraction (PDFium crashing on a malformed PDF, an
+    # OOM kill), which breaks the whole pool; replace it and retry once
+    for attempt in range(2):
+        executor = get_executor()
+        try:
+            results = executor.map(extract_page_range, [path] * len(starts), starts, stops)
+            return "\n".join(part for parts in results for part in parts)
+        except BrokenProcessPool:
+            discard_executor(executor)
+            if attempt:
+                raise
@@ -1,20 +1,88 @@
 import os
 import time
-from pinecone import Pinecone, ServerlessSpec
-from sentence_transformers import SentenceTransformer
+from pinecone import ServerlessSpec
+from pinecone.grpc import PineconeGRPC
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import re
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import hashlib
+from collections import deque
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+# One pooled session so repeat requests to the same host reuse connections
+http_session = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=50,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+)
+http_session.mount('http://', http_adapter)
+http_session.mount('https://', http_adapter)
+
+# Class names of likely article containers, and URL fragments of article pages
+CONTENT_CLASS_RE = re.compile('content|article|post')
+ARTICLE_URL_RE = re.compile('/20|article|post|blog')
+WORD_RE = re.compile(r'\S+')
+
+# Directory holding an int8-quantized ONNX export of all-MiniLM-L6-v2 (see
+# README); when present it replaces the FP32 PyTorch model
+MINILM_ONNX_DIR = os.getenv("MINILM_ONNX_DIR", "minilm_onnx")
+
+class QuantizedMiniLM:
+    def __init__(self, model_dir: str, file_name: str = "model_quantized.onnx"):
+        """Load a quantized MiniLM ONNX export behind a SentenceTransformer-style encode"""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=file_name)
+    
+    def encode(self, texts, batch_size: int = 64, convert_to_numpy: bool = True):
+        """Embed text(s) with mean pooling and L2 normalization, like all-MiniLM-L6-v2"""
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=256,
+                return_tensors="np"
+            )
+            token_embeddings = self.model(**inputs).last_hidden_state
+            
+            # Average over real tokens only, then scale to unit length
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled / np.linalg.norm(pooled, axis=1, keepdims=True).clip(1e-12))
+        
+        embeddings = np.concatenate(batches) if batches else np.empty((0, 384), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+def load_embedding_model():
+    """Use the quantized ONNX MiniLM when it has been exported, else SBERT"""
+    if os.path.isdir(MINILM_ONNX_DIR):
+        return QuantizedMiniLM(MINILM_ONNX_DIR)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer('all-MiniLM-L6-v2')
 
 class AfricaCreativeRAG:
     def __init__(self, api_key: str, index_name: str = "africa-creative-economy"):
-        """Initialize Pinecone and embedding model"""
-        self.pc = Pinecone(api_key=api_key)
+        """Initialize Pinecone; the embedding model loads on first use"""
+        # gRPC data plane: lower per-request overhead than REST, and upserts
+        # can be issued asynchronously
+        self.pc = PineconeGRPC(api_key=api_key)
         self.index_name = index_name
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
         self.dimension = 384
         
         # Create index if it doesn't exist
@@ -29,6 +97,12 @@ class AfricaCreativeRAG:
         
         self.index = self.pc.Index(index_name)
         self.visited_urls = set()
+        self._emb_cache = EmbeddingCache()
+    
+    @cached_property
+    def embedding_model(self):
+        """Embedding model, loaded on the first encode rather than at startup"""
+        return load_embedding_model()
     
     def scrape_article(self, url: str) -> Dict:
         """Scrape article content from URL"""
@@ -36,10 +110,10 @@ class AfricaCreativeRAG:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
-            response = requests.get(url, headers=headers, timeout=10)
+            response = http_session.get(url, headers=headers, timeout=10)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = BeautifulSoup(response.content, 'lxml')
             
             # Extract title
             title = soup.find('h1')
@@ -49,7 +123,7 @@ class AfricaCreativeRAG:
             article_content = []
             
             # Try common article containers
-            article = soup.find('article') or soup.find('div', class_=re.compile('content|article|post'))
+            article = soup.find('article') or soup.find('div', class_=CONTENT_CLASS_RE)
             
             if article:
                 paragraphs = article.find_all(['p', 'h2', 'h3'])
@@ -73,10 +147,11 @@ class AfricaCreativeRAG:
     def find_article_links(self, base_url: str, max_pages: int = 50) -> List[str]:
         """Find all article links from the website"""
         links = set()
-        to_visit = [base_url]
+        to_visit = deque([base_url])
+        base_netloc = urlparse(base_url).netloc
         
         while to_visit and len(links) < max_pages:
-            current_url = to_visit.pop(0)
+            current_url = to_visit.popleft()
             
             if current_url in self.visited_urls:
                 continue
@@ -87,18 +162,20 @@ class AfricaCreativeRAG:
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                 }
-                response = requests.get(current_url, headers=headers, timeout=10)
-                soup = BeautifulSoup(response.content, 'html.parser')
+                response = http_session.get(current_url, headers=headers, timeout=10)
+                soup = BeautifulSoup(response.content, 'lxml')
                 
                 # Find all links
                 for link in soup.find_all('a', href=True):
                     href = link['href']
+                    if href.startswith(('#', 'mailto:')):
+                        continue
                     full_url = urljoin(base_url, href)
                     
                     # Only include links from the same domain
-                    if urlparse(full_url).netloc == urlparse(base_url).netloc:
+                    if urlparse(full_url).netloc == base_netloc:
                         # Filter for article-like URLs
-                        if any(pattern in full_url for pattern in ['/20', 'article', 'post', 'blog']):
+                        if ARTICLE_URL_RE.search(full_url):
                             links.add(full_url)
                 
                 print(f"Found {len(links)} article links so far...")
@@ -111,11 +188,14 @@ class AfricaCreativeRAG:
     
     def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
         """Split text into overlapping chunks"""
-        words = text.split()
+        # Find word boundaries once; each chunk is then a single slice of the
+        # original text rather than a join over a list of words
+        spans = [match.span() for match in WORD_RE.finditer(text)]
         chunks = []
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
+        for i in range(0, len(spans), chunk_size - overlap):
+            last = min(i + chunk_size, len(spans)) - 1
+            chunk = text[spans[i][0]:spans[last][1]]
             if len(chunk) > 100:  # Minimum chunk size
                 chunks.append(chunk)
         
@@ -123,68 +203,95 @@ class AfricaCreativeRAG:
     
     def generate_id(self, text: str) -> str:
         """Generate unique ID for text chunk"""
-        return hashlib.md5(text.encode()).hexdigest()
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    def embed_and_upsert(self, pending: List[Tuple[Dict, int, str]], batch_size: int = 100) -> List:
+        """Encode (article, chunk_index, chunk) entries in one SBERT batch and start upserting them"""
+        embeddings = self.embedding_model.encode(
+            [chunk for _, _, chunk in pending],
+            batch_size=64,
+            convert_to_numpy=True
+        )
+        
+        vectors = [
+            {
+                'id': f"{article['url_hash']}_{chunk_idx}",
+                'values': embedding.tolist(),
+                'metadata': {
+                    'text': chunk,
+                    'title': article['title'],
+                    'url': article['url'],
+                    'chunk_index': chunk_idx
+                }
+            }
+            for (article, chunk_idx, chunk), embedding in zip(pending, embeddings)
+        ]
+        
+        # Upserts run in the background while the next window is scraped and
+        # encoded; the caller resolves the returned futures
+        futures = [
+            self.index.upsert(vectors=vectors[i:i + batch_size], async_req=True)
+            for i in range(0, len(vectors), batch_size)
+        ]
+        print(f"  Upserting {len(vectors)} vectors")
+        return futures
     
-    def index_articles(self, base_url: str, max_articles: int = 50):
+    def index_articles(self, base_url: str, max_articles: int = 50,
+                       max_workers: int = 8, window: int = 32):
         """Scrape and index articles from the website"""
         print(f"Finding article links from {base_url}...")
         article_urls = self.find_article_links(base_url, max_articles)
         
         print(f"\nFound {len(article_urls)} articles. Starting indexing...")
         
-        vectors_to_upsert = []
-        batch_size = 100
+        # Chunks from up to `window` articles are encoded together
+        pending = []
+        articles_in_window = 0
+        upserts = []
         
-        for idx, url in enumerate(article_urls):
-            print(f"Processing article {idx+1}/{len(article_urls)}: {url}")
-            
-            article_data = self.scrape_article(url)
-            
-            if not article_data['success']:
-                continue
+        # The pool size caps concurrent requests to the site
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.scrape_article, url) for url in article_urls]
             
-            # Chunk the content
-            chunks = self.chunk_text(article_data['content'])
-            
-            for chunk_idx, chunk in enumerate(chunks):
-                # Generate embedding
-                embedding = self.embedding_model.encode(chunk).tolist()
+            for done, future in enumerate(as_completed(futures), 1):
+                article_data = future.result()
+                print(f"Scraped article {done}/{len(article_urls)}: {article_data['url']}")
                 
-                # Create metadata
-                metadata = {
-                    'text': chunk,
-                    'title': article_data['title'],
-                    'url': url,
-                    'chunk_index': chunk_idx
-                }
+                if not article_data['success']:
+                    continue
                 
-                # Create unique ID
-                vector_id = f"{self.generate_id(url)}_{chunk_idx}"
+                # Hash the URL once; vector IDs are url_hash + chunk index
+                article_data['url_hash'] = self.generate_id(article_data['url'])
                 
-                vectors_to_upsert.append({
-                    'id': vector_id,
-                    'values': embedding,
-                    'metadata': metadata
-                })
+                # Chunk the content
+                for chunk_idx, chunk in enumerate(self.chunk_text(article_data['content'])):
+                    pending.append((article_data, chunk_idx, chunk))
                 
-                # Upsert in batches
-                if len(vectors_to_upsert) >= batch_size:
-                    self.index.upsert(vectors=vectors_to_upsert)
-                    print(f"  Upserted batch of {len(vectors_to_upsert)} vectors")
-                    vectors_to_upsert = []
-            
-            time.sleep(0.5)  # Rate limiting
+                articles_in_window += 1
+                if articles_in_window >= window:
+                    upserts.extend(self.embed_and_upsert(pending))
+                    pending = []
+                    articles_in_window = 0
         
         # Upsert remaining vectors
-        if vectors_to_upsert:
-            self.index.upsert(vectors=vectors_to_upsert)
-            print(f"Upserted final batch of {len(vectors_to_upsert)} vectors")
+        if pending:
+            upserts.extend(self.embed_and_upsert(pending))
+        
+        # Wait for every in-flight upsert; raises if any of them failed
+        upserted = sum(future.result().upserted_count for future in upserts)
+        print(f"Upserted {upserted} vectors")
         
         print(f"\n✓ Indexing complete! Total vectors in index: {self.index.describe_index_stats()}")
     
+    def encode_cached(self, text: str) -> List[float]:
+        """Encode text, reusing the embedding of recently seen text"""
+        return self._emb_cache.get_or_compute(
+            text, lambda t: self.embedding_model.encode(t).tolist()
+        )
+    
     def query(self, query_text: str, top_k: int = 5) -> List[Dict]:
         """Query the vector database"""
-        query_embedding = self.embedding_model.encode(query_text).tolist()
+        query_embedding = self.encode_cached(query_text)
         
         results = self.index.query(
             vector=query_embedding,
@@ -0,0 +1,68 @@
+import hashlib
+import time
+from typing import Callable, Dict, List, Optional
+
+import orjson
+
+class SemanticCache:
+    def __init__(self, index, embed_query: Callable[[str], List[float]],
+                 namespace: str = "qcache", threshold: float = 0.95, ttl: int = 86400):
+        """Cache chat answers in a Pinecone namespace keyed by query embedding"""
+        self.index = index
+        self.embed_query = embed_query
+        self.namespace = namespace
+        self.threshold = threshold
+        self.ttl = ttl
+
+    def embed(self, query: str) -> Optional[List[float]]:
+        """Embed a query once so lookup and store can share the vector; None on failure"""
+        try:
+            return self.embed_query(query)
+        except Exception as e:
+            print(f"Error embedding query for semantic cache: {str(e)}")
+            return None
+
+    def lookup(self, vector: Optional[List[float]]) -> Optional[Dict]:
+        """Return the cached answer for a near-identical query, if any"""
+        if vector is None:
+            return None
+        try:
+            results = self.index.query(
+                vector=vector,
+                top_k=1,
+                namespace=self.namespace,
+                include_metadata=True,
+                filter={'ts': {'$gte': time.time() - self.ttl}}
+            )
+        except Exception as e:
+            print(f"Error reading semantic cache: {str(e)}")
+            return None
+
+        matches = results['matches']
+        if not matches or matches[0]['score'] < self.threshold:
+            return None
+
+        metadata = matches[0]['metadata']
+        return {
+            'answer': metadata['answer'],
+            'sources': orjson.loads(metadata['sources'])
+        }
+
+    def store(self, vector: Optional[List[float]], query: str, answer: str, sources: List) -> None:
+        """Cache a freshly generated answer"""
+        if vector is None:
+            return
+        # Pinecone metadata must be flat, so sources are stored as a JSON string
+        metadata = {
+            'query': query,
+            'answer': answer,
+            'sources': orjson.dumps(sources).decode(),
+            'ts': time.time()
+        }
+        try:
+            self.index.upsert(
+                vectors=[(hashlib.sha256(query.encode()).hexdigest(), vector, metadata)],
+                namespace=self.namespace
+            )
+        except Exception as e:
+            print(f"Error writing semantic cache: {str(e)}")
@@ -0,0 +1,27 @@
+"""Background jobs for the ingestion queue.
+
+Run a worker alongside the web process with:
+    rq worker ingest --url $REDIS_URL
+"""
+import pdf_text
+from app11 import app, db, Document, process_and_embed_document
+
+def ingest_document(document_id):
+    """Download, embed and upsert a document, then mark it processed"""
+    try:
+        with app.app_context():
+            document = db.session.get(Document, document_id)
+            if document is None:
+                return False
+            
+            if not process_and_embed_document(document.url, document.filename):
+                # Raise so RQ records the job as failed
+                raise RuntimeError(f"Error processing document {document_id}")
+            
+            document.processed = True
+            db.session.commit()
+            return True
+    finally:
+        # The RQ work-horse leaves with os._exit, which skips the pool's own
+        # cleanup and would orphan its extraction processes
+        pdf_text.shutdown_executor()